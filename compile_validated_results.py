@@ -1,14 +1,13 @@
 import csv
+import io
+import operator
 import os
 import sys
 from datetime import datetime
 
-try:
-	import yaml
-except ImportError:
-	yaml = None
+from election_utils import CONFIG_PARSE_ERRORS, DEFAULT_CONFIG, read_config, write_output_file
 
-DEBUG = True
+DEBUG = False
 
 FACULTY_COLUMN = 2
 
@@ -18,18 +17,7 @@ DEFAULT_EXECUTIVE_CANDIDATES = 2  # 1 + Abstain
 
 VALIDATED_STUDENTS_NUM_HEADERS = 3  # Number of header lines to ignore before reading CSV
 
-DEFAULT_CONFIG = {
-	'faculty_column': -1,
-	'user_column': 2,
-	'frc_votes': 2,
-	'exec_votes': 1,
-	'international_offset': 3,
-	'international_votes': 1,
-	'frc_offset': -1,
-	'frc_elections': [],
-	'exec_offset': 5,
-	'exec_elections': ["VP Internal", "VP External", "President"]
-}
+READ_BUFFER_SIZE = 1024 * 1024  # Read input files in large chunks rather than the default 8 KiB
 
 DEFAULT_OUTPUT_DIR = "compiled_results_{}".format(datetime.now().strftime("%Y%m%d"))
 
@@ -47,50 +35,29 @@ def debug(msg):
 	if DEBUG:
 		print("DEBUG " + msg)
 
-def read_config(config_file):
-	if config_file is None:
-		return DEFAULT_CONFIG
-
-	if yaml is None:
-		print("Error: This script requires the package pyyaml to be installed.  Install it via `pip install pyyaml`")
-		sys.exit(1)
-
-	with open(config_file, 'r') as f:
-		config = yaml.load(f)
-
-	# Populate with default values if not present
-	for key, val in DEFAULT_CONFIG.items():
-		if key not in config:
-			config[key] = val
-
-	return config
-
 def convert_election_name(election):
 	# Creates a file friendly name from a human readable
 
 	return election.lower().replace(' ', '_')
 
-def create_election_files(directory, *elections):
-	# For each frc and exec candidates structure, create a file
-
-	the_files = {}
-	for election_type in elections:
-		for election in election_type:
-			converted_election = convert_election_name(election)
+def write_election_file(directory, election, votes):
+	# Write the collected (user, vote) pairs of a single election to its own file
 
-			the_files[election] = open(os.path.join(directory, converted_election +'.csv'), 'w', newline="")
-			the_files[election].write(",".join(["Email", "Candidate"])+os.linesep)
+	converted_election = convert_election_name(election)
 
-	return the_files
+	# Emails and candidate names are plain text, so the rows are joined directly into the file contents
+	header = ",".join(["Email", "Candidate"])
+	contents = os.linesep.join([header] + [user + "," + vote for user, vote in votes]) + os.linesep
 
-def close_election_files(election_files):
-	# Close all file handlers
+	# Fall back to the csv module to quote the rows if any field holds a comma, quote or line break
+	line_break_chars = contents.count("\n") + contents.count("\r")
+	if '"' in contents or contents.count(",") != len(votes)+1 or line_break_chars != (len(votes)+1)*len(os.linesep):
+		rendered = io.StringIO()
+		rendered.write(header+os.linesep)
+		csv.writer(rendered, lineterminator=os.linesep).writerows(votes)
+		contents = rendered.getvalue()
 
-	for f in election_files.values():
-		try:
-			f.close()
-		except Exception as exc:
-			print("Warning: Cannot close file: {}".format(str(exc)))
+	write_output_file(os.path.join(directory, converted_election +'.csv'), contents.encode('utf-8'))
 
 def build_election_columns(config):
 	# From config file, build a dict of elections and column numbers, for easy refernce while compiling
@@ -120,71 +87,105 @@ def build_election_columns(config):
 
 	return election_columns
 
-def compile_validated_results(validated_file, config, output_directory):
-	# Reads a validated results file and breaks up votes into each election for easy tallying.
+def build_row_getter(columns):
+	# Build a function returning the values of the given columns of a row as a tuple
+	if len(columns) == 0:
+		return lambda row: ()
+
+	getter = operator.itemgetter(*columns)
+
+	# itemgetter returns a bare value rather than a tuple for a single column
+	if len(columns) == 1:
+		return lambda row: (getter(row),)
+
+	return getter
+
+def compile_from_rows(rows, config, output_directory):
+	# Breaks up the votes of validated result rows into each election for easy tallying.
 	# Writes one set of votes for each election (ie. <output_dir>/humanities.csv)
 
-	print()
-	print("Compiling Election Results from {}".format(validated_file))
 	print("Output Directory: {}".format(output_directory))
 	debug("Config: {}".format(config))
 
-	election_files = create_election_files(output_directory, config['frc_elections'], config['exec_elections'], ["International"])
-
 	election_columns = build_election_columns(config)
 
-	# print(election_columns)
-	with open(validated_file, 'r') as validated_f:
-
-		[next(validated_f) for i in range(VALIDATED_STUDENTS_NUM_HEADERS)]
-
-		reader = csv.reader(validated_f)
-
-		for row in reader:
-			# print(row)
-			user = row[election_columns['User']]  # Index-1 to convert to 0-indexing
-			if election_columns["Faculty"] > 0:
-				faculty = row[election_columns['Faculty']]
-			else:
-				faculty = None
-			# debug("International: {}".format(row[election_columns['International']-1]))
-
-			if faculty in config['frc_elections']:
-				# Find right file and write data to it
-				for i in range(config['frc_votes']):
-				
-					vote = row[election_columns[faculty]+i]
-
-					if vote == '':
-						print("Warning: Empty FRC [{}] vote found: {}".format(faculty, user))
-					else:
+	# Collect the votes of every election in a single pass over the validated file
+	election_votes = {election: [] for election in config['frc_elections'] + config['exec_elections'] + ["International"]}
+
+	# Work out the vote columns of every election once, rather than for every row
+	frc_plan = {
+		faculty: (build_row_getter([election_columns[faculty]+i for i in range(config['frc_votes'])]), election_votes[faculty])
+		for faculty in config['frc_elections']
+	}
+	get_international_votes = build_row_getter([election_columns['International']+1+i for i in range(config['international_votes'])])
+	exec_plan = [
+		(exec_role, build_row_getter([election_columns[exec_role]+i for i in range(config['exec_votes'])]), election_votes[exec_role])
+		for exec_role in config['exec_elections']
+	]
+
+	# User and international status are needed from every row, the faculty only if the results have one
+	get_user_international = operator.itemgetter(election_columns['User'], election_columns['International'])
+	faculty_col = election_columns['Faculty'] if election_columns["Faculty"] > 0 else None
+
+	# Empty votes are reported once all rows are compiled
+	warnings = []
+
+	for row in rows:
+		user, international = get_user_international(row)
+		if faculty_col is not None:
+			faculty = row[faculty_col]
+		else:
+			faculty = None
+
+		if faculty in frc_plan:
+			get_votes, votes = frc_plan[faculty]
+			for vote in get_votes(row):
+
+				if vote == '':
+					warnings.append("Warning: Empty FRC [{}] vote found: {}".format(faculty, user))
+				else:
+					if DEBUG:
 						debug("User: [{}][{}] Vote: [{}]".format(user, faculty, vote))
-						election_files[faculty].write(",".join([user, vote])+os.linesep)
-
-			# Compile International FRC Votes
-			
-			if row[election_columns['International']] == 'Yes':
-				for i in range(config['international_votes']):
-					vote = row[election_columns['International']+1+i]
-					print(vote)
-					if vote == '':
-						print("Warning: Empty International Vote found [{}]".format(user))
-					else:
+					votes.append((user, vote))
+
+		# Compile International FRC Votes
+		
+		if international == 'Yes':
+			for vote in get_international_votes(row):
+				if vote == '':
+					warnings.append("Warning: Empty International Vote found [{}]".format(user))
+				else:
+					if DEBUG:
 						debug("User: [{}][International] Vote: [{}]".format(user, vote))
-						election_files['International'].write(",".join([user, vote])+os.linesep)
+					election_votes['International'].append((user, vote))
+
+		# Compile Executive Votes
+		for exec_role, get_votes, votes in exec_plan:
+			for vote in get_votes(row):
+				if vote == '':
+					warnings.append("Warning: Empty Exec vote [{}] found: {}".format(exec_role, user))
+				else:
+					if DEBUG:
+						debug("User: [{}][{}] Vote: [{}]".format(user, exec_role, vote))
+					votes.append((user, vote))
 
-			# Compile Executive Votes
-			for i in range(config['exec_votes']):
-				for exec_role in config['exec_elections']:
-					vote = row[election_columns[exec_role]+i]
+	for warning in warnings:
+		print(warning)
 
-					if vote == '':
-						print("Warning: Empty Exec vote [{}] found: {}".format(exec_role, user))
-					else:
-						debug("User: [{}][{}] Vote: [{}]".format(user, exec_role, vote))
-						election_files[exec_role].write(",".join([user, vote])+os.linesep)					
+	for election, votes in election_votes.items():
+		write_election_file(output_directory, election, votes)
+
+def compile_validated_results(validated_file, config, output_directory):
+	# Reads a validated results file and compiles the votes of each election from it
+
+	print()
+	print("Compiling Election Results from {}".format(validated_file))
+
+	with open(validated_file, 'r', newline="", encoding='utf-8', buffering=READ_BUFFER_SIZE) as validated_f:
+
+		[next(validated_f) for i in range(VALIDATED_STUDENTS_NUM_HEADERS)]
 
-	close_election_files(election_files)
+		compile_from_rows(csv.reader(validated_f), config, output_directory)
 
 
 if __name__ == '__main__':
@@ -202,8 +203,8 @@ if __name__ == '__main__':
 		except FileNotFoundError:
 			print("Error: Config File not found [{}]".format(opts.config))
 			sys.exit(1)
-		except yaml.scanner.ScannerError as exc:
-			print("Error: Scanning Error while reading config file [{}]".format(str(exc)))
+		except CONFIG_PARSE_ERRORS as exc:
+			print("Error: Cannot parse config file [{}]".format(str(exc)))
 			sys.exit(1)
 	else:
 		config = DEFAULT_CONFIG
@@ -0,0 +1,106 @@
+'''
+Shared config and file helpers for the GSA election validation and compilation scripts
+'''
+import json
+import os
+import sys
+
+try:
+	import yaml
+except ImportError:
+	yaml = None
+else:
+	# Use the libyaml based loader when PyYAML was built with it
+	try:
+		from yaml import CSafeLoader as SafeLoader
+	except ImportError:
+		from yaml import SafeLoader
+
+# Exceptions raised for a malformed config file, so callers can report them
+CONFIG_PARSE_ERRORS = (yaml.YAMLError,) if yaml is not None else ()
+
+DEFAULT_CONFIG = {
+	'faculty_column': -1,
+	'user_column': 2,
+	'frc_votes': 2,
+	'exec_votes': 1,
+	'international_offset': 3,
+	'international_votes': 1,
+	'frc_offset': -1,
+	'frc_elections': [],
+	'exec_offset': 5,
+	'exec_elections': ["VP Internal", "VP External", "President"]
+}
+
+def read_config_cache(cache_file, cache_key):
+	# Returns the config cached for the current state of the YAML file, or None if there is no usable cache
+	try:
+		with open(cache_file, 'r') as f:
+			cache = json.load(f)
+	except FileNotFoundError:
+		return None
+	except (OSError, ValueError) as exc:
+		print("Warning: Ignoring unreadable config cache {}: {}".format(cache_file, str(exc)))
+		return None
+
+	if not isinstance(cache, dict) or cache.get('key') != cache_key:
+		return None
+
+	return cache.get('config')
+
+def write_config_cache(cache_file, cache_key, config):
+	# Cache a parsed config as JSON, a config that cannot be cached is simply parsed again next time
+	try:
+		data = json.dumps({'key': cache_key, 'config': config})
+	except (TypeError, ValueError) as exc:
+		print("Warning: Cannot cache config: {}".format(str(exc)))
+		return
+
+	# Write to a temporary file first so a failed write never leaves a partial cache behind
+	tmp_file = cache_file + '.tmp'
+	try:
+		with open(tmp_file, 'w') as f:
+			f.write(data)
+		os.replace(tmp_file, cache_file)
+	except OSError as exc:
+		print("Warning: Cannot write config cache: {}".format(str(exc)))
+		if os.path.exists(tmp_file):
+			os.remove(tmp_file)
+
+def read_config(config_file):
+	if config_file is None:
+		return DEFAULT_CONFIG
+
+	# Reuse the parsed config cached next to the YAML file, as long as the YAML is unchanged
+	cache_file = config_file + '.cache.json'
+	config_stat = os.stat(config_file)
+	cache_key = [config_stat.st_mtime_ns, config_stat.st_size]
+
+	config = read_config_cache(cache_file, cache_key)
+
+	if config is None:
+		if yaml is None:
+			print("Error: This script requires the package pyyaml to be installed.  Install it via `pip install pyyaml`")
+			sys.exit(1)
+
+		with open(config_file, 'r') as f:
+			config = yaml.load(f, Loader=SafeLoader)
+
+		write_config_cache(cache_file, cache_key, config)
+
+	# Populate with default values if not present
+	for key, val in DEFAULT_CONFIG.items():
+		if key not in config:
+			config[key] = val
+
+	return config
+
+def write_output_file(filename, data):
+	# Write already encoded file contents straight to disk, in as few write calls as the OS allows
+	fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+	try:
+		view = memoryview(data)
+		while view:
+			view = view[os.write(fd, view):]
+	finally:
+		os.close(fd)
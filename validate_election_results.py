@@ -4,9 +4,19 @@ Validate GSA Election Results from Google Forms with verified student lists prov
 import os
 import sys
 import csv
+import io
+import operator
+import pickle
 from datetime import datetime
 
+from compile_validated_results import compile_from_rows
+from election_utils import CONFIG_PARSE_ERRORS, read_config, write_output_file
+
 DEFAULT_OUTPUT_DIR = "validation_results_{}".format(datetime.now().strftime('%Y%m%d'))
+COMPILED_RESULTS_DIR = "compiled_results"  # Folder within the destination for the --compile option
+STUDENT_CACHE_VERSION = 1  # Bump whenever the layout of the cached student list changes
+
+READ_BUFFER_SIZE = 1024 * 1024  # Read input files in large chunks rather than the default 8 KiB
 
 class InvalidCSVFileError(Exception):
 	pass
@@ -38,6 +48,13 @@ def create_parser():
 		default=DEFAULT_OUTPUT_DIR, 
 		help="Destination folder to create for all output files.  Default: {}".format(DEFAULT_OUTPUT_DIR)
 	)
+	parser.add_argument(
+		'--compile',
+		action='store_true',
+		help="Also compile the validated votes of each election into <destination>/{}, without re-reading the validated results file".format(COMPILED_RESULTS_DIR)
+	)
+	parser.add_argument('-c', '--config', help="Config file used to compile the validated votes")
+	parser.add_argument('--no-cache', action='store_true', help="Always parse the student list, neither reading nor writing its cache")
 	return parser
 
 def validate_options(parser, opts):
@@ -57,6 +74,24 @@ def validate_options(parser, opts):
 		parser.print_help()
 		sys.exit(1)
 
+	if opts.config is not None and not os.path.exists(opts.config):
+		print("Argument Error: [Config] Config File {} does not exist".format(opts.config))
+		print()
+		parser.print_help()
+		sys.exit(1)
+
+	# Read the compile config up front, so a bad config stops the run before any results are written
+	opts.compile_config = None
+	if opts.compile:
+		try:
+			opts.compile_config = read_config(opts.config)
+		except FileNotFoundError:
+			print("Argument Error: [Config] Config File {} does not exist".format(opts.config))
+			sys.exit(1)
+		except CONFIG_PARSE_ERRORS as exc:
+			print("Argument Error: [Config] Cannot parse config file {}: {}".format(opts.config, str(exc)))
+			sys.exit(1)
+
 	create_destination_folder(opts.destination)
 
 	print("Reading from Student List: {}".format(opts.students))
@@ -82,17 +117,55 @@ def check_valid_csv_file(csv_file):
 	if not os.path.exists(csv_file):
 		raise InvalidCSVFileError("CSV File {} does not exist".format(csv_file))
 
-def read_student_list(filename, comments=None, headers=None):
+def read_student_list(filename, comments=None, headers=None, use_cache=True):
 	# Read student list from a csv file
 	#
 	# Data saved in following format:
 	# 	{
-	#		<str> email: [<str> faculty, <bool> international] 
+	#		<str> email: (<str> faculty, <bool> international)
 	#	}
+	#
+	# Faculty names are interned so every student shares one string per faculty
 	print("Reading Student List: {}".format(filename))
+
+	# Reuse the parsed student list cached next to the file, as long as neither the file nor the
+	# way it is parsed has changed.  The cache is unpickled, so only use it in a trusted directory
+	# (or pass use_cache=False / --no-cache)
+	cache_file = filename + '.cache.pkl'
+	file_stat = os.stat(filename)
+	cache_key = (
+		STUDENT_CACHE_VERSION,
+		file_stat.st_mtime_ns,
+		file_stat.st_size,
+		comments,
+		headers,
+		StudentListFormat.EMAIL_HEADER,
+		StudentListFormat.FACULTY_HEADER,
+		StudentListFormat.INTERNATIONAL_HEADER,
+		StudentListFormat.INTERNATIONAL_LABEL
+	)
+
+	if use_cache and os.path.exists(cache_file):
+		try:
+			with open(cache_file, 'rb') as f:
+				cached_key, students = pickle.load(f)
+		except Exception as exc:
+			print("Warning: Ignoring unreadable student list cache {}: {}".format(cache_file, str(exc)))
+		else:
+			if cached_key == cache_key:
+				print("Read {} students from cache {}".format(len(students), cache_file))
+				return students
+
 	students = {}
 	
-	with open(filename, 'r') as f:
+	# Pull the three student columns out of each row in a single call
+	student_columns = operator.itemgetter(
+		StudentListFormat.EMAIL_HEADER,
+		StudentListFormat.FACULTY_HEADER,
+		StudentListFormat.INTERNATIONAL_HEADER
+	)
+
+	with open(filename, 'r', newline="", encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
 		reader = csv.reader(f)
 
 		# Headers 
@@ -107,85 +180,125 @@ def read_student_list(filename, comments=None, headers=None):
 		
 		for row in reader:
 			try:
-				email = row[StudentListFormat.EMAIL_HEADER].lower()
-				faculty = row[StudentListFormat.FACULTY_HEADER].title()
-				international = row[StudentListFormat.INTERNATIONAL_HEADER] == StudentListFormat.INTERNATIONAL_LABEL
+				email, faculty, international = student_columns(row)
 
 			except IndexError:
 				print("Error: Cannot parse row: {}".format(row))
 
 			else:
-				students[email] = [faculty, international]
+				students[email.lower()] = (sys.intern(faculty.title()), international == StudentListFormat.INTERNATIONAL_LABEL)
 
 		print("Read {} lines from student list".format(reader.line_num))
 
+	if use_cache:
+		try:
+			with open(cache_file, 'wb') as f:
+				pickle.dump((cache_key, students), f, protocol=5)
+		except OSError as exc:
+			print("Warning: Cannot write student list cache: {}".format(str(exc)))
+
 	return students
 
 def results_datetime_str():
 	# Format a nice datetime string for the results file
 	return "Results From {}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
-def write_results_header(filename, comment_str, header_str=None):
-	# Overwrites a given file with initial comments and optional headers
-	with open(filename, 'w', newline="") as f:
-		f.write("# " + comment_str+os.linesep)
-		f.write("# " + results_datetime_str()+os.linesep)
-		if header_str is not None:
-			f.write(str(header_str)+os.linesep)
+def write_results_header(f, comment_str, header_str=None):
+	# Writes initial comments and optional headers to an open results file
+	f.write("# " + comment_str+os.linesep)
+	f.write("# " + results_datetime_str()+os.linesep)
+	if header_str is not None:
+		f.write(str(header_str)+os.linesep)
+
+def write_results_file(filename, comment_str, header_str, rows):
+	# Overwrites a given results file with its header and all collected rows
+	# The file is rendered in memory first so it is written as one contiguous block
+	contents = io.StringIO()
+	write_results_header(contents, comment_str, header_str=header_str)
+	csv.writer(contents, lineterminator=os.linesep).writerows(rows)
+
+	write_output_file(filename, contents.getvalue().encode('utf-8'))
 
-def void_student(f, row, reason):
+def void_student(void_rows, row, reason):
 	# Void a student for a given reason, the reason is included in the voided results file
 	print("VOIDING STUDENT: [{}] {}".format(reason, row[ResultsListFormat.EMAIL_HEADER]))
-	f.write(",".join(row + [reason])+os.linesep)
+	void_rows.append(row + [reason])
+
+def validate_student(valid_rows, row):
+	# Validate a student, their data is written to the validated results file
+	valid_rows.append(row)
+
+def check_student(students, email, faculty, international):
+	# Compare a results entry against the student list
+	# Returns the reason the entry should be voided, or None if it is valid
+	student = students.get(email)
+
+	if student is None:
+		return 'Not in Student List'
+
+	# Both faculty names are already title-cased when read
+	if faculty is not None and student[0] != faculty:
+		return "Incorrect Faculty: Expected [{}] Got [{}] ".format(faculty, student[0])
 
-def validate_student(f, row):
-	# Validate a student, write their data to the validated results file
-	f.write(",".join(row)+os.linesep)
+	if international is not None and student[1] != international:
+		return "Incorrect International Status: Expected [{}] Got [{}]".format(international, student[1])
 
-def validate_results_list(students_list, results_list, destination_dir):
+	return None
+
+def validate_results_list(students_list, results_list, destination_dir, use_cache=True):
 	# Read election results list from csv file
+	# Returns the validated rows so they can be compiled without reading them back
 	print("Validating Election Results")
 
 	# Read student list
-	students = read_student_list(students_list)
+	students = read_student_list(students_list, use_cache=use_cache)
 
 	# Create and set up results files, voided and validated
 	voided_file = os.path.join(destination_dir, 'voided_results.csv')
 	validated_file = os.path.join(destination_dir, 'validated_results.csv')
 	
-	summary = {'entries': 0, 'validated': 0, 'voided': 0}  # Statistics counts
+	entries = 0  # Number of rows read from the results file
 
 	# Read the results file and validate each row
-	with open(results_list, 'r') as f:
+	with open(results_list, 'r', newline="", encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
 
 		reader = csv.reader(f)
 
-		# Get the header string and write them to the results files
+		# Get the header string for the results files
 		results_header = next(reader) 
-		write_results_header(voided_file, 'VOIDED STUDENTS', header_str=",".join(results_header + ['Reason']))	
-		write_results_header(validated_file, 'VALIDATED STUDENTS', header_str=",".join(results_header))
 
-		void_f = open(voided_file, 'a', newline="")
-		validate_f = open(validated_file, 'a', newline="")
+		# Buffer the voided and validated rows, they are written once the whole file is read
+		void_rows = []
+		valid_rows = []
+
+		# Title-case each distinct faculty name only once, there are only a handful of them
+		faculty_names = {}
 
 		print("FacultyHeader: {}".format(ResultsListFormat.FACULTY_HEADER))
 		print("InternationalHeader: {}".format(ResultsListFormat.INTERNATIONAL_HEADER))
 
-		for row in reader:
-			summary['entries'] += 1
+		# Look up the results format once, rather than on every row
+		email_col = ResultsListFormat.EMAIL_HEADER
+		faculty_col = ResultsListFormat.FACULTY_HEADER if ResultsListFormat.FACULTY_HEADER > 0 else None
+		international_col = ResultsListFormat.INTERNATIONAL_HEADER if ResultsListFormat.INTERNATIONAL_HEADER > 0 else None
+		international_label = ResultsListFormat.INTERNATIONAL_LABEL
 
+		for entries, row in enumerate(reader, 1):
 			# Extract validation data from row.  
 			# Warng about bad formatting in a single row, nope out for any other exception
 			try:
-				email = row[ResultsListFormat.EMAIL_HEADER].lower()
+				email = row[email_col].lower()
 
-				if ResultsListFormat.FACULTY_HEADER > 0:
-					faculty = row[ResultsListFormat.FACULTY_HEADER].title()
+				if faculty_col is not None:
+					faculty = faculty_names.get(row[faculty_col])
+					if faculty is None:
+						faculty = sys.intern(row[faculty_col].title())
+						faculty_names[row[faculty_col]] = faculty
 				else:
 					faculty = None
 
-				if ResultsListFormat.INTERNATIONAL_HEADER > 0:
-					international = row[ResultsListFormat.INTERNATIONAL_HEADER] == ResultsListFormat.INTERNATIONAL_LABEL
+				if international_col is not None:
+					international = row[international_col] == international_label
 				else:
 					international = None
 
@@ -200,23 +313,18 @@ def validate_results_list(students_list, results_list, destination_dir):
 
 			
 			# Compare data against student list
-			if email not in students:
-				void_student(void_f, row, 'Not in Student List')
-				summary['voided'] += 1
-			elif faculty is not None:
-				if students[email][0].lower() != faculty.lower():
-					void_student(void_f, row, "Incorrect Faculty: Expected [{}] Got [{}] ".format(faculty, students[email][0]))
-					summary['voided'] += 1
-
-			elif students[email][1] != international:
-				void_student(void_f, row, "Incorrect International Status: Expected [{}] Got [{}]".format(international, students[email][1]))
-				summary['voided'] += 1
+			reason = check_student(students, email, faculty, international)
+
+			if reason is None:
+				validate_student(valid_rows, row)
 			else:
-				validate_student(validate_f, row)
-				summary['validated'] += 1
+				void_student(void_rows, row, reason)
+
+	write_results_file(voided_file, 'VOIDED STUDENTS', ",".join(results_header + ['Reason']), void_rows)
+	write_results_file(validated_file, 'VALIDATED STUDENTS', ",".join(results_header), valid_rows)
 
-		void_f.close()
-		validate_f.close()
+	# Statistics counts, the buffered rows already hold the validated and voided totals
+	summary = {'entries': entries, 'validated': len(valid_rows), 'voided': len(void_rows)}
 
 	# Print summary
 	print("Done!")
@@ -229,6 +337,8 @@ def validate_results_list(students_list, results_list, destination_dir):
 	print("Validated Entries: {}".format(summary['validated']))
 	print("Voided Entries: {}".format(summary['voided']))
 
+	return valid_rows
+
 
 if __name__ == '__main__':
 	import argparse
@@ -237,6 +347,15 @@ if __name__ == '__main__':
 	validate_options(parser, opts)      # Check provided argument options are sane
 
 	# Validate results with provided command line options
-	validate_results_list(opts.students, opts.results, opts.destination)
+	validated_rows = validate_results_list(opts.students, opts.results, opts.destination, use_cache=not opts.no_cache)
+
+	# Compile the validated votes straight from memory
+	if opts.compile:
+		compiled_dir = os.path.join(opts.destination, COMPILED_RESULTS_DIR)
+		create_destination_folder(compiled_dir)
+
+		print()
+		print("Compiling Election Results")
+		compile_from_rows(validated_rows, opts.compile_config, compiled_dir)
 
 